@@ -1,97 +1,194 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
 import re
+from html import escape
 from pathlib import Path
-from datetime import date
 
+import numpy as np
 import pandas as pd
 import streamlit as st
 
 DATA_DIR = Path("data")
 ROMP_OPTIONS = [f"{i:02d}" for i in range(1, 13)]
+ROMP_RE = re.compile(r"(\d+)")  # ROMP03 -> 03
 
-def is_blank(x) -> bool:
-    if pd.isna(x):
-        return True
-    return str(x).strip() == ""
-
-def normalize_romp(val) -> str | None:
-    if pd.isna(val):
-        return None
-    s = str(val).strip()
-    m = re.search(r"(\d+)", s)  # ROMP03 -> 03
-    return m.group(1).zfill(2) if m else None
-
-def normalize_sap_to_int(val):
-    """Return a nullable integer (Int64) value or <NA> if not parseable."""
-    if pd.isna(val):
-        return pd.NA
-    s = str(val).strip()
-
-    # handle Excel reading '40.0' sometimes
-    if re.fullmatch(r"\d+\.0", s):
-        s = s[:-2]
-
-    num = pd.to_numeric(s, errors="coerce")
-    if pd.isna(num):
-        return pd.NA
-    return int(num)
+# bump whenever clean_one_file's output schema changes, so Parquet
+# caches written by older code are rebuilt instead of silently reused
+CACHE_SCHEMA_VERSION = 3
 
-def clean_one_file(path: Path) -> pd.DataFrame:
-    df = pd.read_excel(path, sheet_name=0)
+# calamine parses xlsx in native code and is much faster than openpyxl
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    EXCEL_ENGINE = "openpyxl"
 
+def clean_one_file(path: Path) -> pd.DataFrame:
     required = ["SAP", "ROMP", "Catalog", "Shipped Qty", "Ship Date", "Carrier"]
-    missing = [c for c in required if c not in df.columns]
+
+    # check the header first so we can report missing columns ourselves,
+    # then re-read only the columns we actually use
+    header = pd.read_excel(path, sheet_name=0, nrows=0, engine=EXCEL_ENGINE)
+    missing = [c for c in required if c not in header.columns]
     if missing:
         raise ValueError(f"{path.name} is missing columns: {missing}")
 
-    # delete row if Shipped Qty OR Ship Date is blank
-    df = df[~df["Shipped Qty"].apply(is_blank) & ~df["Ship Date"].apply(is_blank)].copy()
+    df = pd.read_excel(
+        path,
+        sheet_name=0,
+        usecols=required,
+        # Arrow-backed strings: packed buffers, comparisons run in Arrow
+        # kernels instead of per-object Python
+        dtype={"Catalog": "string[pyarrow]", "Carrier": "string[pyarrow]"},
+        engine=EXCEL_ENGINE,
+    )
 
-    # Normalize ROMP
-    df["ROMP"] = df["ROMP"].apply(normalize_romp)
+    # delete row if Shipped Qty OR Ship Date is blank (vectorized, no per-row Python)
+    mask_qty = df["Shipped Qty"].notna() & df["Shipped Qty"].astype("string").str.strip().ne("")
+    mask_date = df["Ship Date"].notna() & df["Ship Date"].astype("string").str.strip().ne("")
+    df = df.loc[mask_qty & mask_date].reset_index(drop=True)
 
-    # Normalize SAP
-    df["SAP"] = df["SAP"].apply(normalize_sap_to_int).astype("Int64")
+    # Normalize ROMP (ROMP03 -> 03), one vectorized extract over the column
+    df["ROMP"] = df["ROMP"].astype("string").str.extract(ROMP_RE, expand=False).str.zfill(2)
 
-    # Normalize Ship Date to a date (so searching works reliably)
-    df["Ship Date"] = pd.to_datetime(df["Ship Date"], errors="coerce").dt.date
+    # Normalize SAP (handles Excel reading '40.0' sometimes); truncate
+    # before the Int64 cast, which raises on non-integral floats
+    df["SAP"] = np.trunc(pd.to_numeric(df["SAP"].astype(str).str.strip(), errors="coerce")).astype("Int64")
 
-    # Drop rows missing key fields after normalization
-    df = df.dropna(subset=["ROMP", "SAP", "Ship Date"])
+    # Normalize Ship Date to midnight but keep datetime64 dtype, so
+    # comparisons and min/max stay vectorized instead of per-row Python
+    df["Ship Date"] = pd.to_datetime(df["Ship Date"], errors="coerce").dt.normalize()
 
-    # remove fully duplicated rows (within file)
-    df = df.drop_duplicates()
+    # Drop rows missing key fields after normalization; duplicates are
+    # removed once globally in build_database
+    df = df.dropna(subset=["ROMP", "SAP", "Ship Date"])
 
     return df[required]
 
-@st.cache_data(show_spinner=False)
+def load_one_file(path: Path) -> pd.DataFrame:
+    """Load a cleaned frame for one xlsx, via a Parquet sidecar when it's fresh.
+
+    Parquet reads are much faster than re-parsing xlsx, so cold starts
+    (e.g. after a Streamlit Cloud restart) skip Excel entirely unless the
+    source file changed.
+    """
+    cache = path.with_name(f"{path.stem}.v{CACHE_SCHEMA_VERSION}.parquet")
+    if cache.exists() and cache.stat().st_mtime >= path.stat().st_mtime:
+        return pd.read_parquet(cache)
+
+    df = clean_one_file(path)
+    # write to a temp file and rename so a crash mid-write can't leave a
+    # truncated sidecar that passes the freshness check
+    tmp = cache.with_name(cache.name + ".tmp")
+    df.to_parquet(tmp)
+    tmp.replace(cache)
+    return df
+
+# cache_resource shares one in-memory frame across sessions with no pickle
+# round-trip per rerun (cache_data copies on every hit). The returned frame
+# must be treated as read-only; downstream code only does boolean masks.
+@st.cache_resource(show_spinner=False)
 def build_database(data_dir: Path) -> pd.DataFrame:
     files = sorted(data_dir.glob("*.xlsx"))
     if not files:
         return pd.DataFrame(columns=["SAP", "ROMP", "Catalog", "Shipped Qty", "Ship Date", "Carrier"])
 
-    frames = [clean_one_file(p) for p in files]
-    db = pd.concat(frames, ignore_index=True)
+    # one Parquet for the whole cleaned database, keyed by the xlsx set;
+    # if nothing changed, a cold start is a single Parquet read
+    sig = hashlib.sha1(
+        repr((CACHE_SCHEMA_VERSION, sorted((p.name, p.stat().st_mtime_ns) for p in files))).encode()
+    ).hexdigest()
+    db_cache = data_dir / "_db.parquet"
+    sig_file = data_dir / "_db.sig"
+    if db_cache.exists() and sig_file.exists() and sig_file.read_text() == sig:
+        return pd.read_parquet(db_cache)
+
+    # files are independent, so clean them concurrently; calamine and the
+    # Parquet reader release the GIL. Sequential on single-core hosts.
+    # Frames are fed straight into concat rather than collected in a
+    # separate list first, so per-file frames become collectable sooner.
+    if len(files) > 1 and (os.cpu_count() or 1) > 1:
+        with ThreadPoolExecutor() as ex:
+            db = pd.concat(ex.map(load_one_file, files), ignore_index=True)
+    else:
+        db = pd.concat((load_one_file(p) for p in files), ignore_index=True)
 
     # remove fully duplicated rows across ALL files
-    db = db.drop_duplicates().reset_index(drop=True)
+    db = db.drop_duplicates(
+        subset=["SAP", "ROMP", "Ship Date", "Catalog", "Carrier", "Shipped Qty"],
+        ignore_index=True,
+    )
+
+    # ROMP/Carrier have a handful of distinct values; category dtype stores
+    # them as small int codes, so the equality masks compare ints not strings
+    db["ROMP"] = db["ROMP"].astype("category")
+    db["Carrier"] = db["Carrier"].astype("string[pyarrow]").str.strip().astype("category")
+
+    # write the parquet first, sig last, so a crash mid-write just forces a rebuild
+    tmp = data_dir / "_db.parquet.tmp"
+    db.to_parquet(tmp)
+    tmp.replace(db_cache)
+    sig_file.write_text(sig)
 
     return db
 
-def render_card(row: pd.Series):
-    st.markdown(
-        f"""
-        <div style="padding: 12px; border: 1px solid rgba(0,0,0,0.15); border-radius: 12px; margin-bottom: 10px;">
-          <div style="font-size: 16px; font-weight: 700; margin-bottom: 6px;">
-            ROMP {row['ROMP']} • SAP {int(row['SAP'])}
-          </div>
-          <div><b>Catalog:</b> {row.get('Catalog','') or ''}</div>
-          <div><b>Shipped Qty:</b> {row.get('Shipped Qty','') or ''}</div>
-          <div><b>Ship Date:</b> {row.get('Ship Date','') or ''}</div>
-          <div><b>Carrier:</b> {row.get('Carrier','') or ''}</div>
-        </div>
-        """,
-        unsafe_allow_html=True,
-    )
+# sorted (ROMP, SAP) index makes the SAP tab's lookup a binary search
+# instead of two full-column scans plus a boolean AND
+@st.cache_resource(show_spinner=False)
+def sap_index(data_dir: Path) -> pd.DataFrame:
+    return build_database(data_dir).set_index(["ROMP", "SAP"]).sort_index()
+
+# ROMP has only 12 values, so split once and precompute everything each
+# tab needs from its slice; reruns then touch one small dict entry
+# instead of scanning or aggregating the whole database
+@st.cache_resource(show_spinner=False)
+def build_index(data_dir: Path) -> dict[str, dict]:
+    db = build_database(data_dir)
+    index = {}
+    for romp, grp in db.groupby("ROMP", sort=False, observed=True):
+        grp = grp.reset_index(drop=True)
+        dates = grp["Ship Date"]
+        index[romp] = {
+            "df": grp,
+            "carriers": sorted({str(c) for c in grp["Carrier"].dropna() if str(c)}),
+            "date_min": dates.min(),
+            "date_max": dates.max(),
+        }
+    return index
+
+# cached so reruns don't rescan the data directory just to show a count
+@st.cache_resource(show_spinner=False)
+def source_file_count(data_dir: Path) -> int:
+    return len(sorted(data_dir.glob("*.xlsx")))
+
+CARD_TMPL = """
+<div style="padding: 12px; border: 1px solid rgba(0,0,0,0.15); border-radius: 12px; margin-bottom: 10px;">
+  <div style="font-size: 16px; font-weight: 700; margin-bottom: 6px;">
+    ROMP {romp} &bull; SAP {sap}
+  </div>
+  <div><b>Catalog:</b> {catalog}</div>
+  <div><b>Shipped Qty:</b> {qty}</div>
+  <div><b>Ship Date:</b> {date}</div>
+  <div><b>Carrier:</b> {carrier}</div>
+</div>
+"""
+
+def render_cards(matches: pd.DataFrame) -> str:
+    cards = []
+    cols = ["ROMP", "SAP", "Catalog", "Shipped Qty", "Ship Date", "Carrier"]
+    for romp, sap, catalog, qty, date, carrier in matches[cols].itertuples(index=False, name=None):
+        fields = {
+            "romp": romp,
+            "sap": int(sap),
+            "catalog": catalog if pd.notna(catalog) else "",
+            "qty": qty if pd.notna(qty) else "",
+            "date": date.strftime("%Y-%m-%d") if pd.notna(date) else "",
+            "carrier": carrier if pd.notna(carrier) else "",
+        }
+        # escape every field uniformly so no future field slips through unescaped
+        cards.append(CARD_TMPL.format(**{k: escape(str(v)) for k, v in fields.items()}))
+    return "\n".join(cards)
 
 def show_results(matches: pd.DataFrame, label: str):
     st.subheader("Results")
@@ -107,14 +204,19 @@ def show_results(matches: pd.DataFrame, label: str):
         # Ship Date (oldest -> newest)
         matches = matches.sort_values(["Ship Date", "SAP", "Catalog"], ascending=[True, True, True], na_position="last")
 
-    for _, r in matches.iterrows():
-        render_card(r)
+    # one markdown call for all cards: a single Streamlit delta message
+    # instead of one round-trip per row
+    st.markdown(render_cards(matches), unsafe_allow_html=True)
 
 
 st.set_page_config(page_title="CMH116 BusDuct Lookup", layout="centered")
 st.title("CMH116 BusDuct Lookup")
+st.caption(f"{source_file_count(DATA_DIR)} source files loaded")
 
 db = build_database(DATA_DIR)
+db_by_romp_sap = sap_index(DATA_DIR)
+romp_index = build_index(DATA_DIR)
+EMPTY_DB = db.iloc[0:0]
 
 sort_mode = st.radio(
     "Sort results",
@@ -140,20 +242,18 @@ with tab_sap:
             st.error("SAP must be a number.")
             st.stop()
 
-        matches = db[(db["ROMP"] == romp) & (db["SAP"] == sap_val)]
+        try:
+            matches = db_by_romp_sap.loc[[(romp, sap_val)]].reset_index()
+        except KeyError:
+            matches = EMPTY_DB
         show_results(matches, f"ROMP {romp} + SAP {sap_val}")
 
 with tab_carrier:
     romp = st.selectbox("Select ROMP", ROMP_OPTIONS, key="romp_carrier")
 
-    carriers = (
-        db.loc[db["ROMP"] == romp, "Carrier"]
-        .dropna()
-        .astype(str)
-        .str.strip()
-        .unique()
-    )
-    carriers = sorted([c for c in carriers if c])
+    idx = romp_index.get(romp)
+    sub = idx["df"] if idx else EMPTY_DB
+    carriers = idx["carriers"] if idx else []
 
     carrier = st.selectbox("Select Carrier", ["(Select)"] + carriers, key="carrier_select")
     search_clicked = st.button("Search", type="primary", key="btn_carrier")
@@ -164,18 +264,19 @@ with tab_carrier:
             st.stop()
 
         carrier_norm = carrier.strip()
-        matches = db[(db["ROMP"] == romp) & (db["Carrier"].astype(str).str.strip() == carrier_norm)]
+        matches = sub[sub["Carrier"].astype(str).str.strip() == carrier_norm]
         show_results(matches, f"ROMP {romp} + Carrier {carrier_norm}")
 
 with tab_date:
     romp = st.selectbox("Select ROMP", ROMP_OPTIONS, key="romp_date")
 
-    dates = db.loc[db["ROMP"] == romp, "Ship Date"].dropna()
-    if dates.empty:
+    idx = romp_index.get(romp)
+    if idx is None:
         st.info("No ship dates available for this ROMP.")
     else:
-        min_d = dates.min()
-        max_d = dates.max()
+        sub = idx["df"]
+        min_d = idx["date_min"]
+        max_d = idx["date_max"]
 
         ship_date = st.date_input(
             "Select Ship Date",
@@ -187,7 +288,7 @@ with tab_date:
         search_clicked = st.button("Search", type="primary", key="btn_date")
 
         if search_clicked:
-            matches = db[(db["ROMP"] == romp) & (db["Ship Date"] == ship_date)]
+            matches = sub[sub["Ship Date"] == pd.Timestamp(ship_date)]
             show_results(matches, f"ROMP {romp} + Ship Date {ship_date}")
 
 with tab_romp:
@@ -195,6 +296,7 @@ with tab_romp:
     search_clicked = st.button("Search", type="primary", key="btn_romp_all")
 
     if search_clicked:
-        matches = db[db["ROMP"] == romp]
+        idx = romp_index.get(romp)
+        matches = idx["df"] if idx else EMPTY_DB
 
         show_results(matches, f"ROMP {romp} (all shipped rows)")